@@ -0,0 +1,302 @@
+"""
+Client for the Stemformatics API shared by the MCP servers.
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Any, Callable
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils import (
+    json_loads, ttl_cache, make_cache_key, response_validators, conditional_headers,
+    PackedExpression, merge_results, SingleFlight
+)
+
+try:
+    import ijson
+except ImportError:  # ijson is optional, streamed responses fall back to a full parse
+    ijson = None
+
+logger = logging.getLogger("stemformatics-mcp")
+
+# Streamed responses with a known length below this are parsed in one go,
+# which is faster than ijson when the whole body fits comfortably in memory
+STREAM_MIN_BYTES = 5_000_000
+
+# Values of a list parameter sent per request when a tool is asked for many,
+# and the number of those batched requests allowed in flight at once
+BATCH_SIZE = 200
+FANOUT_LIMIT = 16
+
+# Metadata lookups arriving within this many seconds of each other are sent
+# upstream as one batch request
+METADATA_WINDOW = 0.005
+
+# Batch endpoint statuses that are worth trying again rather than giving up on it
+BATCH_RETRY_STATUSES = (408, 429)
+
+def may_be_large(response: requests.Response) -> bool:
+    """
+    Check whether a response body may reach STREAM_MIN_BYTES once decoded.
+    The length of a compressed body says nothing about its decoded size.
+    """
+    if response.headers.get('content-encoding', 'identity') != 'identity':
+        return True
+    return int(response.headers.get('content-length', STREAM_MIN_BYTES)) >= STREAM_MIN_BYTES
+
+def parse_stream(response: requests.Response) -> Any:
+    """
+    Parse a JSON body with ijson as it arrives, raising the errors requests
+    raises for a buffered body if it is malformed, empty or cut off.
+    """
+    response.raw.decode_content = True
+    try:
+        for result in ijson.items(response.raw, "", use_float=True):
+            return result
+    except ijson.JSONError as e:
+        raise ValueError(str(e)) from e
+    except urllib3.exceptions.HTTPError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    raise ValueError("Empty JSON response")
+
+class ApiClient:
+    """
+    Requests to the Stemformatics API, configured from the server config.
+
+    Connections are pooled on one session with retries. GET results are
+    cached and revalidated with conditional requests once expired, and
+    identical GETs in flight at the same time share one upstream request.
+    """
+
+    def __init__(self, config: Dict, cache: Any):
+        base_url = config["api_server"]["base_url"]
+        self.url_prefix = base_url.rstrip('/') + '/'
+        self.timeout = config["api_server"]["timeout"]
+        self.cache = cache
+        self.cache_enabled = bool(config["cache"]["enabled"])
+        self.cache_ttl = config["cache"]["ttl_seconds"]
+        self.cache_dtype = config["cache"]["dtype"]
+
+        # Shared HTTP session so connections to the API are pooled and kept alive
+        api_key = config["auth"]["api_key"] if config["auth"]["use_auth"] else None
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"} if api_key else {})
+        self.session.mount(base_url, HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 502, 503, 504))
+        ))
+
+        # Concurrent identical GET requests to the API, across worker threads and,
+        # so that duplicates do not each hold a worker thread, on the event loop
+        self.inflight = SingleFlight()
+        self.pending: Dict[tuple, asyncio.Future] = {}
+        self.fanout = asyncio.Semaphore(FANOUT_LIMIT)
+
+    def memoize(self, func: Callable) -> Callable:
+        """Memoize an idempotent tool in-process when caching is enabled"""
+        if not self.cache_enabled:
+            return func
+        return ttl_cache(maxsize=1024, ttl=self.cache_ttl)(func)
+
+    def request(self, endpoint: str, method: str = "GET", params: Dict = None, data: Dict = None,
+                stream: bool = False, quantize: bool = False, probe: bool = False) -> Dict:
+        """
+        Make a request to the Stemformatics API with proper error handling.
+
+        With stream set, a JSON body of STREAM_MIN_BYTES or more, or of unknown
+        or compressed length, is parsed with ijson as it arrives instead of being
+        buffered in full first, which keeps peak memory down for large payloads.
+        With quantize set, a numeric matrix result is cached in the configured
+        cache dtype and restored to floats when served from the cache.
+        With probe set, the request is for an endpoint the API may not have, so
+        a client error or 501 in reply is logged at debug level, not as an error.
+        """
+        url = self.url_prefix + endpoint.lstrip('/')
+        if method != "GET":
+            return self._request(url, method, params, data, None, stream, quantize, probe)
+
+        # One key serves the cache and lets identical GETs in flight at the same
+        # time share one upstream request
+        cache_key = make_cache_key(url, params)
+        return self.inflight.do(cache_key, lambda: self._request(url, method, params, data, cache_key, stream, quantize, probe))
+
+    async def request_async(self, endpoint: str, method: str = "GET", params: Dict = None, data: Dict = None,
+                            stream: bool = False, quantize: bool = False, probe: bool = False) -> Dict:
+        """
+        Await request in a worker thread, so a slow API call never blocks the
+        event loop that serves other tool calls. Calls share the pooled session.
+
+        Identical GET requests awaited at the same time share one worker thread
+        and one upstream request.
+        """
+        if method != "GET":
+            return await asyncio.to_thread(self.request, endpoint, method, params, data, stream, quantize, probe)
+
+        url = self.url_prefix + endpoint.lstrip('/')
+        cache_key = make_cache_key(url, params)
+        pending = self.pending.get(cache_key)
+        if pending is None:
+            pending = self.pending[cache_key] = asyncio.ensure_future(asyncio.to_thread(
+                self.inflight.do, cache_key,
+                lambda: self._request(url, method, params, data, cache_key, stream, quantize, probe)
+            ))
+            pending.add_done_callback(lambda _: self.pending.pop(cache_key, None))
+        # A cancelled caller must not cancel the request for others awaiting it
+        return await asyncio.shield(pending)
+
+    async def request_batched(self, endpoint: str, params: Dict, name: str, values: List[str], **kwargs) -> Dict:
+        """
+        Request a list parameter BATCH_SIZE values at a time, with the batches
+        in flight concurrently, and merge their results into one.
+        """
+        async def fetch(batch: List[str]) -> Dict:
+            async with self.fanout:
+                return await self.request_async(endpoint, params={**params, name: ",".join(batch)}, **kwargs)
+
+        batches = [values[i:i + BATCH_SIZE] for i in range(0, len(values), BATCH_SIZE)]
+        return merge_results(await asyncio.gather(*(fetch(batch) for batch in batches)))
+
+    def _request(self, url: str, method: str, params: Optional[Dict], data: Optional[Dict],
+                 cache_key: Optional[tuple], stream: bool, quantize: bool, probe: bool = False) -> Dict:
+        """Check the cache, then call the API and cache the result under cache_key if one is given"""
+        use_cache = self.cache_enabled and cache_key is not None
+        cache = self.cache
+
+        try:
+            # Check cache first if it's a GET request
+            stale = None
+            if use_cache:
+                cached_result = cache.get(cache_key)
+                if cached_result is None:
+                    # An expired result is reused if the server confirms it is unchanged
+                    stale = cache.get_stale(cache_key)
+                elif isinstance(cached_result, PackedExpression):
+                    return cached_result.unpack()
+                else:
+                    return cached_result
+
+            # Make the request
+            with self.session.request(
+                method=method,
+                url=url,
+                params=params,
+                json=data,
+                headers=conditional_headers(stale[1]) if stale else None,
+                timeout=self.timeout,
+                stream=stream
+            ) as response:
+                if stale and response.status_code == 304:
+                    cache.refresh(cache_key)
+                    cached_result = stale[0]
+                    return cached_result.unpack() if isinstance(cached_result, PackedExpression) else cached_result
+                response.raise_for_status()
+                logger.debug("Response from %s encoded as %s", url, response.headers.get('content-encoding', 'identity'))
+
+                # Handle different response types
+                if response.headers.get('content-type') != 'application/json':
+                    # For raw file responses
+                    result = {'content': response.text, 'is_file': True}
+                elif stream and ijson is not None and may_be_large(response):
+                    result = parse_stream(response)
+                else:
+                    result = json_loads(response.content)
+
+            # Cache the result if it's a GET request
+            if use_cache:
+                packed = None
+                if quantize and self.cache_dtype != "f64":
+                    packed = PackedExpression.pack(result, self.cache_dtype)
+                cache.set(cache_key, packed or result, response_validators(response.headers))
+
+            return result
+
+        except requests.exceptions.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            unsupported = probe and status is not None and (400 <= status < 500 or status == 501)
+            logger.log(logging.DEBUG if unsupported else logging.ERROR, f"API request error: {e}")
+            if status is not None:
+                return {"error": str(e), "status": status}
+            return {"error": str(e)}
+        except ValueError as e:
+            logger.error(f"Invalid JSON in API response: {e}")
+            return {"error": str(e)}
+
+class MetadataLoader:
+    """
+    Coalesces metadata lookups for many datasets into one upstream request.
+
+    Lookups arriving within METADATA_WINDOW of the first are collected and
+    sent as one POST to datasets/batch, up to BATCH_SIZE ids per request, and
+    each awaiter gets its own dataset's entry. A lone lookup, and any dataset
+    missing from the batch response, falls back to the regular cached GET,
+    as does every lookup once the API rejects the batch endpoint with a
+    client error or 501.
+    """
+
+    def __init__(self, client: ApiClient, window: float = METADATA_WINDOW):
+        self.client = client
+        self.window = window
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+        self.batch_supported = True
+
+    async def load(self, dataset_id: str) -> Dict:
+        """Get the metadata of one dataset, batched with concurrent lookups"""
+        if not self.batch_supported:
+            return await self._fetch_one(dataset_id)
+
+        future = self.pending.get(dataset_id)
+        if future is None:
+            future = self.pending[dataset_id] = asyncio.get_running_loop().create_future()
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush())
+        # A cancelled caller must not cancel the lookup for others awaiting the same dataset
+        return await asyncio.shield(future)
+
+    async def _flush(self) -> None:
+        """Wait out the window, then resolve every lookup collected during it"""
+        await asyncio.sleep(self.window)
+        pending, self.pending, self.flush_task = self.pending, {}, None
+
+        ids = list(pending)
+        try:
+            results = {}
+            for batch in await asyncio.gather(*(self._fetch(ids[i:i + BATCH_SIZE])
+                                                for i in range(0, len(ids), BATCH_SIZE))):
+                results.update(batch)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for dataset_id, future in pending.items():
+            if not future.done():
+                future.set_result(results[dataset_id])
+
+    async def _fetch(self, ids: List[str]) -> Dict[str, Dict]:
+        """Fetch metadata for ids, in one request where the API allows it"""
+        batch = {}
+        if len(ids) > 1 and self.batch_supported:
+            async with self.client.fanout:
+                batch = await self.client.request_async("datasets/batch", method="POST", data={"ids": ids}, probe=True)
+            error = batch.get("error") if isinstance(batch, dict) else None
+            status = batch.get("status") if error is not None else None
+            if status is not None and status not in BATCH_RETRY_STATUSES and (400 <= status < 500 or status == 501):
+                logger.info(f"The API rejects batch metadata requests ({status}), fetching datasets one at a time")
+                self.batch_supported = False
+            if not isinstance(batch, dict) or error is not None:
+                batch = {}
+
+        results = {dataset_id: batch[dataset_id] for dataset_id in ids if isinstance(batch.get(dataset_id), dict)}
+        missing = [dataset_id for dataset_id in ids if dataset_id not in results]
+        results.update(zip(missing, await asyncio.gather(*(self._fetch_one(dataset_id) for dataset_id in missing))))
+        return results
+
+    async def _fetch_one(self, dataset_id: str) -> Dict:
+        """Get the metadata of one dataset with its own request"""
+        async with self.client.fanout:
+            return await self.client.request_async(f"datasets/{dataset_id}/metadata")
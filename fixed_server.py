@@ -8,15 +8,12 @@ It handles requests for dataset metadata, sample information, and gene expressio
 
 import os
 import sys
-import json
 import logging
 from typing import Dict, List, Optional, Any, Union
-import pandas as pd
-import numpy as np
-import requests
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
-from utils import setup_cache, validate_config
+from utils import setup_cache, load_config, BOOL_STR
+from api_client import ApiClient
 
 # Load environment variables and configuration
 load_dotenv()
@@ -32,26 +29,16 @@ logger = logging.getLogger("stemformatics-mcp")
 # Load configuration
 CONFIG_PATH = os.getenv("CONFIG_PATH", "config.json")
 try:
-    if os.path.exists(CONFIG_PATH):
-        with open(CONFIG_PATH, 'r') as f:
-            config = json.load(f)
-    else:
-        logger.warning(f"Config file not found at {CONFIG_PATH}, using example config")
-        with open("config.example.json", 'r') as f:
-            config = json.load(f)
-            
-    # Validate config
-    validate_config(config)
-    
+    config = load_config(CONFIG_PATH)
 except Exception as e:
     logger.error(f"Error loading configuration: {e}")
     sys.exit(1)
 
 # Initialize API client and cache
 cache = setup_cache(config)
-BASE_URL = config["api_server"]["base_url"]
-TIMEOUT = config["api_server"]["timeout"]
-API_KEY = config["auth"]["api_key"] if config["auth"]["use_auth"] else None
+API = ApiClient(config, cache)
+api_request = API.request
+memoize = API.memoize
 
 # Initialize MCP server
 mcp = FastMCP(
@@ -59,51 +46,10 @@ mcp = FastMCP(
     description=config["server"]["description"]
 )
 
-def api_request(endpoint: str, method: str = "GET", params: Dict = None, data: Dict = None) -> Dict:
-    """Make a request to the Stemformatics API with proper error handling"""
-    headers = {"Authorization": f"Bearer {API_KEY}"} if API_KEY else {}
-    url = f"{BASE_URL}/{endpoint.lstrip('/')}"
-    
-    try:
-        # Check cache first if it's a GET request
-        if method == "GET" and config["cache"]["enabled"]:
-            cache_key = f"{url}_{str(params)}"
-            cached_result = cache.get(cache_key)
-            if cached_result is not None:
-                return cached_result
-        
-        # Make the request
-        response = requests.request(
-            method=method,
-            url=url,
-            params=params,
-            json=data,
-            headers=headers,
-            timeout=TIMEOUT
-        )
-        response.raise_for_status()
-        
-        # Handle different response types
-        if response.headers.get('content-type') == 'application/json':
-            result = response.json()
-        else:
-            # For raw file responses
-            result = {'content': response.text, 'is_file': True}
-        
-        # Cache the result if it's a GET request
-        if method == "GET" and config["cache"]["enabled"]:
-            cache_key = f"{url}_{str(params)}"
-            cache.set(cache_key, result)
-            
-        return result
-    
-    except requests.exceptions.RequestException as e:
-        logger.error(f"API request error: {e}")
-        return {"error": str(e)}
-
 # Tool definitions
 
 @mcp.tool()
+@memoize
 def get_dataset_metadata(dataset_id: str) -> Dict:
     """
     Get metadata for a specific dataset.
@@ -117,6 +63,7 @@ def get_dataset_metadata(dataset_id: str) -> Dict:
     return api_request(f"datasets/{dataset_id}/metadata")
 
 @mcp.tool()
+@memoize
 def get_dataset_samples(dataset_id: str, orient: str = "records", as_file: bool = False) -> Dict:
     """
     Get samples for a specific dataset.
@@ -129,12 +76,13 @@ def get_dataset_samples(dataset_id: str, orient: str = "records", as_file: bool
     Returns:
         Dictionary containing sample information
     """
-    params = {"orient": orient, "as_file": str(as_file).lower()}
-    return api_request(f"datasets/{dataset_id}/samples", params=params)
+    params = {"orient": orient, "as_file": BOOL_STR[as_file]}
+    return api_request(f"datasets/{dataset_id}/samples", params=params, stream=True)
 
 @mcp.tool()
 def get_dataset_expression(dataset_id: str, gene_id: Optional[str] = None, key: str = "cpm", 
-                           log2: bool = False, orient: str = "records", as_file: bool = False) -> Dict:
+                           log2: bool = False, orient: str = "records", as_file: bool = False,
+                           gene_ids: Optional[List[str]] = None) -> Dict:
     """
     Get gene expression data for a dataset.
     
@@ -145,21 +93,24 @@ def get_dataset_expression(dataset_id: str, gene_id: Optional[str] = None, key:
         log2: Whether to return log2 values
         orient: Orientation of the data (records, list, dict, etc.)
         as_file: Whether to return the data as a file
+        gene_ids: Optional list of Ensembl gene IDs to filter by in one request
     
     Returns:
         Dictionary containing gene expression data
     """
     params = {
         "key": key,
-        "log2": str(log2).lower(),
+        "log2": BOOL_STR[log2],
         "orient": orient,
-        "as_file": str(as_file).lower()
+        "as_file": BOOL_STR[as_file]
     }
     
-    if gene_id:
+    if gene_ids:
+        params["gene_id"] = ",".join(gene_ids)
+    elif gene_id:
         params["gene_id"] = gene_id
         
-    return api_request(f"datasets/{dataset_id}/expression", params=params)
+    return api_request(f"datasets/{dataset_id}/expression", params=params, stream=True, quantize=True)
 
 # ... [other tool and resource definitions remain the same] ...
 
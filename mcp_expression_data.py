@@ -1,21 +1,88 @@
-import json
+import re
 import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from mcp_stemformatics import (
     get_dataset_expression,
     search_datasets,
     get_dataset_metadata
 )
+from utils import json_dumps
 
-def get_expression_data_in_chunks(dataset_id, genes=None, chunk_size=5, delay_seconds=2):
+logger = logging.getLogger(__name__)
+
+# Report progress of chunked retrieval every this many batches
+PROGRESS_EVERY = 64
+
+# Matches datasets whose title or description mentions expression
+EXPRESSION_PATTERN = re.compile(r'expression', re.IGNORECASE)
+
+def chunked(items, size):
+    """Yield successive lists of at most size items"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class AdaptiveThrottle:
+    """
+    Thread-safe request pacing that only slows down when the server shows strain.
+    
+    Requests start immediately while responses are fast and successful. Once the
+    smoothed latency rises above slow_seconds, starts are spaced delay_seconds
+    apart, and each consecutive failure doubles that spacing up to max_delay.
+    """
+    
+    def __init__(self, delay_seconds, slow_seconds=0.2, smoothing=0.3, max_delay=60):
+        self.delay_seconds = delay_seconds
+        self.slow_seconds = slow_seconds
+        self.smoothing = smoothing
+        self.max_delay = max_delay
+        self.latency = 0.0
+        self.failures = 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+        
+    def interval(self):
+        """Current spacing between request starts"""
+        if self.failures:
+            return min(self.delay_seconds * 2 ** self.failures, self.max_delay)
+        if self.latency > self.slow_seconds:
+            return self.delay_seconds
+        return 0
+        
+    def wait(self):
+        """Block until the caller may start its request"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval()
+        if slot > now:
+            time.sleep(slot - now)
+            
+    def record(self, latency, ok):
+        """Feed back the latency and outcome of a finished request"""
+        with self.lock:
+            self.latency += self.smoothing * (latency - self.latency)
+            self.failures = 0 if ok else self.failures + 1
+            if not ok:
+                # Hold back requests that have not started yet as well
+                self.next_slot = max(self.next_slot, time.monotonic() + self.interval())
+
+def get_expression_data_in_chunks(dataset_id, genes=None, chunk_size=5, delay_seconds=2, max_workers=4,
+                                  as_matrix=False):
     """
-    Retrieve gene expression data for a dataset, one gene at a time
-    to avoid overwhelming the server
+    Retrieve gene expression data for a dataset, chunk_size genes per request,
+    with a bounded number of requests in flight to avoid overwhelming the server
     
     Args:
         dataset_id: ID of the dataset to retrieve expression data for
         genes: List of gene IDs to retrieve, if None will retrieve all genes one by one
-        chunk_size: Number of genes to retrieve in one batch (if supported)
-        delay_seconds: Delay between requests to reduce server load
+        chunk_size: Number of genes to retrieve in one request
+        delay_seconds: Time between request starts once the server is slow or failing
+        max_workers: Maximum number of concurrent requests
+        as_matrix: If true, pack the values into a float32 matrix as they arrive
+            and return (matrix, gene_ids, sample_ids) instead of a dict of records
     """
     if genes is None:
         # First get dataset metadata to see what genes are available
@@ -29,50 +96,109 @@ def get_expression_data_in_chunks(dataset_id, genes=None, chunk_size=5, delay_se
                 print(f"Found {len(genes)} genes in metadata")
             else:
                 print("Could not find gene information in metadata. Will retrieve all expression data at once.")
+                if as_matrix:
+                    return expression_matrix(get_all_expression_data(dataset_id, orient="index"))
                 return get_all_expression_data(dataset_id)
                 
         except Exception as e:
             print(f"Error getting metadata: {e}")
-            return None
+            return expression_matrix(None) if as_matrix else None
     
     all_expression_data = {}
+    batches = list(chunked(genes, chunk_size))
+    
+    # Matrix rows in gene order, with columns in the sample order of the first row
+    gene_ids = []
+    sample_ids = None
+    matrix_rows = []
     
-    # Retrieve expression data for each gene
-    for i, gene_id in enumerate(genes):
-        print(f"Retrieving expression data for gene {gene_id} ({i+1}/{len(genes)})")
+    # Back off by delay_seconds or more only while the server is slow or failing
+    throttle = AdaptiveThrottle(delay_seconds)
+    
+    def fetch_batch(batch):
+        throttle.wait()
+        started = time.monotonic()
+        # Index orientation keys each row by gene ID, so one response can be
+        # split back into the same per-gene records a single-gene request returns
+        batch_data = get_dataset_expression(
+            dataset_id=dataset_id,
+            gene_ids=batch,
+            orient="index"
+        )
+        failed = isinstance(batch_data, dict) and "error" in batch_data
+        throttle.record(time.monotonic() - started, ok=not failed)
+        if failed:
+            raise RuntimeError(batch_data["error"])
+        return batch_data
+    
+    # Retrieve expression data for up to max_workers batches concurrently
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_batch, batch) for batch in batches]
         
-        try:
-            gene_data = get_dataset_expression(
-                dataset_id=dataset_id,
-                gene_id=gene_id,
-                orient="records"
-            )
+        done = 0
+        for i, (batch, future) in enumerate(zip(batches, futures)):
+            done += len(batch)
+            if i % PROGRESS_EVERY == 0 or i == len(batches) - 1:
+                logger.info("Retrieving expression data for genes (%d/%d)", done, len(genes))
             
-            if gene_data:
-                all_expression_data[gene_id] = gene_data
-                print(f"Successfully retrieved data for gene {gene_id}")
-            else:
-                print(f"No expression data found for gene {gene_id}")
+            try:
+                batch_data = future.result() or {}
                 
-            # Delay to avoid overwhelming the server
-            if (i+1) % chunk_size == 0:
-                print(f"Processed {i+1} genes, pausing for {delay_seconds} seconds...")
-                time.sleep(delay_seconds)
-                
-        except Exception as e:
-            print(f"Error retrieving expression data for gene {gene_id}: {e}")
-            # Continue with the next gene
-            continue
+                for gene_id in batch:
+                    gene_row = batch_data.get(gene_id)
+                    if gene_row and as_matrix:
+                        if sample_ids is None:
+                            sample_ids = list(gene_row)
+                        matrix_rows.append(np.array([gene_row.get(s) for s in sample_ids], dtype=np.float32))
+                        gene_ids.append(gene_id)
+                        logger.debug("Successfully retrieved data for gene %s", gene_id)
+                    elif gene_row:
+                        all_expression_data[gene_id] = [gene_row]
+                        logger.debug("Successfully retrieved data for gene %s", gene_id)
+                    else:
+                        logger.debug("No expression data found for gene %s", gene_id)
+                    
+            except Exception as e:
+                logger.warning("Error retrieving expression data for genes %s: %s", ", ".join(batch), e)
+                # Continue with the next batch
+                continue
+    
+    if as_matrix:
+        sample_ids = sample_ids or []
+        if matrix_rows:
+            matrix = np.vstack(matrix_rows)
+        else:
+            matrix = np.empty((0, len(sample_ids)), dtype=np.float32)
+        print(f"Retrieved expression data for {len(gene_ids)} genes")
+        return matrix, gene_ids, sample_ids
     
     print(f"Retrieved expression data for {len(all_expression_data)} genes")
     return all_expression_data
 
-def get_all_expression_data(dataset_id):
+def expression_matrix(index_data):
+    """
+    Pack index-oriented expression data ({gene: {sample: value}}) into a
+    float32 (matrix, gene_ids, sample_ids) triple, which is empty if there is no data
+    
+    Args:
+        index_data: Expression data keyed by gene ID, or None
+    """
+    if not isinstance(index_data, dict) or "error" in index_data:
+        index_data = {}
+    gene_ids = list(index_data)
+    sample_ids = list(index_data[gene_ids[0]]) if gene_ids else []
+    matrix = np.array(
+        [[index_data[g].get(s) for s in sample_ids] for g in gene_ids], dtype=np.float32
+    ).reshape(len(gene_ids), len(sample_ids))
+    return matrix, gene_ids, sample_ids
+
+def get_all_expression_data(dataset_id, orient="records"):
     """
     Retrieve all expression data for a dataset at once
     
     Args:
         dataset_id: ID of the dataset to retrieve expression data for
+        orient: Orientation of the data (records, index, etc.)
     """
     print(f"Retrieving all expression data for dataset {dataset_id}")
     
@@ -80,7 +206,7 @@ def get_all_expression_data(dataset_id):
         expression_data = get_dataset_expression(
             dataset_id=dataset_id,
             gene_id=None,  # Retrieve all genes
-            orient="records"
+            orient=orient
         )
         
         if expression_data:
@@ -96,8 +222,8 @@ def get_all_expression_data(dataset_id):
 
 def save_data_to_file(data, filename):
     """Save data to a JSON file"""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+    with open(filename, 'wb', buffering=65536) as f:
+        f.write(json_dumps(data, indent=True))
     print(f"Data saved to {filename}")
 
 def find_datasets_with_expression_data(query_string=None):
@@ -121,10 +247,10 @@ def find_datasets_with_expression_data(query_string=None):
         # Filter datasets that mention expression in their description or title
         expression_datasets = []
         for dataset in datasets:
-            title = dataset.get('title', '').lower()
-            description = dataset.get('description', '').lower()
-            
-            if ('expression' in title or 'expression' in description) and dataset.get('dataset_id'):
+            if dataset.get('dataset_id') and (
+                EXPRESSION_PATTERN.search(dataset.get('title') or '')
+                or EXPRESSION_PATTERN.search(dataset.get('description') or '')
+            ):
                 expression_datasets.append(dataset)
                 
         print(f"Found {len(expression_datasets)} datasets that likely have expression data")
@@ -135,6 +261,8 @@ def find_datasets_with_expression_data(query_string=None):
         return []
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    
     # Example 1: Find datasets with expression data
     expression_datasets = find_datasets_with_expression_data()
     
@@ -1,4 +1,3 @@
-import json
 import time
 from mcp_stemformatics import (
     search_datasets,
@@ -6,6 +5,7 @@ from mcp_stemformatics import (
     get_dataset_samples,
     search_samples
 )
+from utils import json_dumps
 
 def search_datasets_in_chunks(query_string=None, chunk_size=10, delay_seconds=1):
     """
@@ -116,8 +116,8 @@ def search_all_samples(query_string=None, field=None, limit=50):
 
 def save_data_to_file(data, filename):
     """Save data to a JSON file"""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+    with open(filename, 'wb', buffering=65536) as f:
+        f.write(json_dumps(data, indent=True))
     print(f"Data saved to {filename}")
 
 if __name__ == "__main__":
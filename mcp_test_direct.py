@@ -1,5 +1,9 @@
-import json
 import time
+from mcp_stemformatics_search_datasets import mcp_stemformatics_search_datasets
+from mcp_stemformatics_get_dataset_samples import mcp_stemformatics_get_dataset_samples
+from mcp_stemformatics_get_dataset_metadata import mcp_stemformatics_get_dataset_metadata
+from mcp_stemformatics_search_samples import mcp_stemformatics_search_samples
+from utils import json_dumps
 
 def search_datasets_small_query():
     """
@@ -9,8 +13,6 @@ def search_datasets_small_query():
     
     try:
         # This function call will be handled by Cursor's MCP interface
-        from mcp_stemformatics_search_datasets import mcp_stemformatics_search_datasets
-        
         # Use a specific query to limit results
         datasets = mcp_stemformatics_search_datasets(query_string="dendritic cell")
         
@@ -35,8 +37,6 @@ def get_samples_for_dataset(dataset_id):
     print(f"Getting samples for dataset {dataset_id}")
     
     try:
-        from mcp_stemformatics_get_dataset_samples import mcp_stemformatics_get_dataset_samples
-        
         # Get the samples
         samples = mcp_stemformatics_get_dataset_samples(
             dataset_id=dataset_id, 
@@ -64,8 +64,6 @@ def get_dataset_details(dataset_id):
     print(f"Getting metadata for dataset {dataset_id}")
     
     try:
-        from mcp_stemformatics_get_dataset_metadata import mcp_stemformatics_get_dataset_metadata
-        
         # Get the metadata
         metadata = mcp_stemformatics_get_dataset_metadata(dataset_id=dataset_id)
         
@@ -91,8 +89,6 @@ def search_all_samples_limited(query_string="dendritic cell", limit=10):
     print(f"Searching for samples with query: {query_string}")
     
     try:
-        from mcp_stemformatics_search_samples import mcp_stemformatics_search_samples
-        
         # Search for samples with a limited result set
         samples = mcp_stemformatics_search_samples(
             query_string=query_string,
@@ -113,8 +109,8 @@ def search_all_samples_limited(query_string="dendritic cell", limit=10):
 
 def save_data_to_file(data, filename):
     """Save data to a JSON file"""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+    with open(filename, 'wb', buffering=65536) as f:
+        f.write(json_dumps(data, indent=True))
     print(f"Data saved to {filename}")
 
 if __name__ == "__main__":
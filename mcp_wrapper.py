@@ -8,15 +8,18 @@ to fix JSON formatting issues and ensure proper communication.
 
 import sys
 import os
-import json
 import logging
-import subprocess
 import re
-from typing import Optional, Dict, Any
+import selectors
+import subprocess
+from typing import Optional, Dict, Any, List
+from utils import json_loads
 
-# Setup logging
+# Setup logging, at the level the launch scripts set for the server as well
+log_level = os.environ.get('LOGGING_LEVEL', 'INFO')
+numeric_level = getattr(logging, log_level.upper(), logging.INFO)
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=numeric_level,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     handlers=[logging.FileHandler("/tmp/mcp_wrapper.log")]
 )
@@ -34,103 +37,189 @@ logger.info(f"Script directory: {SCRIPT_DIR}")
 logger.info(f"Server script: {SERVER_SCRIPT}")
 logger.info(f"Transport mode: {os.environ.get('MCP_TRANSPORT', 'not set')}")
 
-def fix_json(data: str) -> str:
-    """Fix common JSON formatting issues"""
-    # Log the raw input for debugging
-    logger.debug(f"Raw input: {data[:200]}")
+# Maximum number of bytes read from a pipe at once
+CHUNK_SIZE = 65536
+
+# Capacity requested for the pipes to the server on Linux, where the default is 64 KiB
+PIPE_SIZE = 1 << 20
+
+# Lines longer than this are forwarded without being scanned
+MAX_FRAME_BYTES = 1 << 20
+
+# Lines nesting objects deeper than this are forwarded without further scanning
+MAX_NESTING = 10_000
+
+# Byte values the extractor's state machine reacts to
+QUOTE = ord('"')
+BACKSLASH = ord('\\')
+OPEN_BRACE = ord('{')
+CLOSE_BRACE = ord('}')
+
+# Finds the next byte the state machine reacts to, so runs of other bytes are skipped in C
+STRUCTURAL_BYTES = re.compile(rb'["\\{}]')
+
+class IncrementalJsonExtractor:
+    """
+    Single-pass extractor for JSON objects in the server's output stream.
     
-    try:
-        # Check if it's already valid JSON
-        json.loads(data)
-        logger.debug("JSON is already valid")
-        return data
-    except json.JSONDecodeError as e:
-        logger.debug(f"JSON decode error: {e}, attempting to fix")
+    Bytes are scanned once as they arrive, tracking string, escape and nesting
+    state, so output split across reads is never re-scanned. Results are
+    produced a line at a time, since the stdio transport never puts a raw
+    newline inside a message: each valid object found on a line is emitted on
+    its own line, and a line without one is passed through unchanged, as is a
+    line that is valid JSON as a whole, such as a batch or a string. A line
+    holding exactly one balanced object would be forwarded either way, so it
+    is not parsed at all, and only lines that do not start with an object are
+    parsed whole.
+    Lines over MAX_FRAME_BYTES, or nesting objects deeper than MAX_NESTING,
+    are passed through without scanning the rest.
+    
+    State is fully typed so the class can be compiled with mypyc as is.
+    """
+    
+    buf: bytearray
+    start: int
+    depth: int
+    in_str: bool
+    escaped: int
+    candidates: List[bytes]
+    passthrough: bool
+    
+    def __init__(self) -> None:
+        self._reset()
         
-        # Attempt multiple fix strategies
+    def _reset(self) -> None:
+        """Clear all state at the start of a new line"""
+        self.buf = bytearray()
+        self.start = -1
+        self.depth = 0
+        self.in_str = False
+        self.escaped = -1
+        self.candidates = []
+        self.passthrough = False
         
-        # 1. Find complete JSON object
-        try:
-            opening_brackets = 0
-            closing_brackets = 0
-            in_quotes = False
-            escape_next = False
-            start_idx = data.find('{')
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Consume a chunk of output and return the fixed lines it completed"""
+        lines = []
+        pos = 0
+        while pos < len(chunk):
+            end = chunk.find(b"\n", pos)
+            stop = len(chunk) if end == -1 else end + 1
             
-            if start_idx == -1:
-                logger.debug("No JSON object found")
-                return data
-                
-            for i in range(start_idx, len(data)):
-                char = data[i]
+            if self.passthrough:
+                lines.append(chunk[pos:stop])
+            elif len(self.buf) + stop - pos > MAX_FRAME_BYTES:
+                logger.warning(f"Output line exceeds {MAX_FRAME_BYTES} bytes, forwarding it unchecked")
+                lines.append(bytes(self.buf) + chunk[pos:stop])
+                self._reset()
+                self.passthrough = True
+            elif not self._scan(chunk[pos:stop]):
+                logger.warning(f"Output line nests deeper than {MAX_NESTING} levels, forwarding it unchecked")
+                lines.append(bytes(self.buf))
+                self._reset()
+                self.passthrough = True
                 
-                if escape_next:
-                    escape_next = False
-                    continue
-                    
-                if char == '\\':
-                    escape_next = True
-                    continue
-                    
-                if char == '"' and not escape_next:
-                    in_quotes = not in_quotes
-                    continue
+            if end != -1:
+                if not self.passthrough:
+                    lines.extend(self._end_line())
+                self._reset()
+            pos = stop
+        return lines
+        
+    def flush(self) -> List[bytes]:
+        """Finish a trailing line that was not newline-terminated"""
+        lines = self._end_line() if self.buf and not self.passthrough else []
+        self._reset()
+        return lines
+        
+    def _scan(self, segment: bytes) -> bool:
+        """Advance the state machine over part of the current line, returning False if it nests too deep"""
+        buf = self.buf
+        offset = len(buf)
+        buf += segment
+        start, depth, in_str, escaped = self.start, self.depth, self.in_str, self.escaped
+        
+        for match in STRUCTURAL_BYTES.finditer(buf, offset):
+            i = match.start()
+            if i == escaped:
+                continue
+            char = buf[i]
+            if in_str:
+                if char == BACKSLASH:
+                    # Positions index the whole line, so this holds across reads
+                    escaped = i + 1
+                elif char == QUOTE:
+                    in_str = False
+            elif char == QUOTE:
+                # Quotes only matter once inside an object
+                in_str = depth > 0
+            elif char == OPEN_BRACE:
+                if depth == 0:
+                    start = i
+                depth += 1
+                if depth > MAX_NESTING:
+                    return False
+            elif char == CLOSE_BRACE and depth:
+                depth -= 1
+                if depth == 0:
+                    self.candidates.append(bytes(buf[start:i + 1]))
+                    start = -1
                     
-                if not in_quotes:
-                    if char == '{':
-                        opening_brackets += 1
-                    elif char == '}':
-                        closing_brackets += 1
-                        
-                    if opening_brackets > 0 and opening_brackets == closing_brackets:
-                        # Found complete JSON object
-                        json_part = data[start_idx:i+1]
-                        try:
-                            # Verify it's valid
-                            json.loads(json_part)
-                            logger.debug(f"Found valid JSON object: {json_part[:50]}...")
-                            return json_part
-                        except json.JSONDecodeError:
-                            # Not valid, continue searching
-                            pass
-        except Exception as e:
-            logger.debug(f"Error in bracket matching: {e}")
+        self.start, self.depth, self.in_str, self.escaped = start, depth, in_str, escaped
+        return True
         
-        # 2. Try regular expression approaches
-        try:
-            # Try to match a complete JSON object
-            pattern = r'(\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\})'
-            matches = re.findall(pattern, data)
+    def _end_line(self) -> List[bytes]:
+        """Return the valid objects found on the current line, or the line itself"""
+        candidates = self.candidates
+        line = self.buf.strip()
+        if line[:1] == b"{":
+            if len(candidates) == 1 and len(candidates[0]) == len(line):
+                # The common case of a clean frame is forwarded as it is without a parse
+                return [bytes(self.buf)]
+            # Any other line starting with an object cannot be valid JSON as a whole
+        elif self._line_is_json():
+            # Batches and other JSON values are forwarded as they are
+            return [bytes(self.buf)]
             
-            for match in matches:
-                try:
-                    # Verify it's valid JSON
-                    json.loads(match)
-                    logger.debug(f"Found valid JSON via regex: {match[:50]}...")
-                    return match
-                except json.JSONDecodeError:
-                    continue
-        except Exception as e:
-            logger.debug(f"Error in regex approach: {e}")
-            
-        # 3. Last resort: Look for content-type header and attempt to find JSON
+        objects = [candidate + b"\n" for candidate in candidates if self._is_json(candidate)]
+        if objects:
+            return objects
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("No JSON object found, forwarding line: %r", bytes(self.buf[:100]))
+        return [bytes(self.buf)]
+        
+    def _line_is_json(self) -> bool:
+        """Check whether the whole current line parses as JSON"""
         try:
-            if "content-type" in data.lower() and "application/json" in data.lower():
-                # Try to extract JSON after the headers
-                parts = data.split("\r\n\r\n", 1)
-                if len(parts) > 1:
-                    try:
-                        json.loads(parts[1])
-                        logger.debug("Found JSON after headers")
-                        return parts[1]
-                    except json.JSONDecodeError:
-                        pass
-        except Exception as e:
-            logger.debug(f"Error in header extraction: {e}")
+            json_loads(self.buf)
+        except ValueError:
+            return False
+        return True
+        
+    def _is_json(self, candidate: bytes) -> bool:
+        """Check whether a balanced object parses as JSON"""
+        try:
+            json_loads(candidate)
+        except ValueError as e:
+            logger.debug("Discarding invalid JSON object: %s", e)
+            return False
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found valid JSON object: %r...", candidate[:50])
+        return True
+
+def enlarge_pipes(*pipes) -> None:
+    """Raise the kernel capacity of pipes to PIPE_SIZE, so bursts of output block less often"""
+    if not sys.platform.startswith("linux"):
+        return
+    import fcntl
     
-    # All fixes failed, return the original
-    logger.debug(f"Could not fix JSON, returning original: {data[:100]}...")
-    return data
+    for pipe in pipes:
+        try:
+            fcntl.fcntl(pipe.fileno(), getattr(fcntl, "F_SETPIPE_SZ", 1031), PIPE_SIZE)
+        except OSError as e:
+            # Unprivileged processes are capped by /proc/sys/fs/pipe-max-size
+            logger.info(f"Cannot resize pipe to {PIPE_SIZE} bytes: {e}")
+            return
 
 def main():
     logger.info("Starting MCP wrapper")
@@ -149,65 +238,147 @@ def main():
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1,  # Line buffered
+        bufsize=65536,  # Binary and block buffered, flushed once per forwarded chunk
         cwd=SCRIPT_DIR,  # Set working directory to script directory
         env=env  # Pass environment variables
     )
+    enlarge_pipes(process.stdin, process.stdout, process.stderr)
     
-    def process_output():
-        """Process and fix JSON from server output"""
-        logger.info("Starting output processor thread")
-        while True:
-            line = process.stdout.readline()
-            if not line:
-                logger.info("Output stream closed")
-                break
-                
+    stdin_fd = sys.stdin.fileno()
+    server_fd = process.stdin.fileno()
+    stdout = sys.stdout.buffer
+    extractor = IncrementalJsonExtractor()
+    errors = bytearray()
+    
+    # Input the server has not accepted yet. Its stdin never blocks the loop,
+    # so output keeps draining while the server is busy writing instead of reading.
+    pending = bytearray()
+    os.set_blocking(server_fd, False)
+    
+    # Requests need no fixing, so on Linux they bypass Python entirely
+    use_splice = hasattr(os, "splice")
+    spliced = False
+    
+    def forward_input() -> bool:
+        """Forward available input from stdin to the server, returning False at end of input"""
+        nonlocal use_splice, spliced
+        if use_splice:
             try:
-                logger.debug(f"Raw output: {line[:100]}")
-                fixed_line = fix_json(line)
-                sys.stdout.write(fixed_line)
-                sys.stdout.flush()
-            except Exception as e:
-                logger.error(f"Error processing output: {e}")
-                # Still try to write something
-                sys.stdout.write(line)
-                sys.stdout.flush()
-    
-    def process_input():
-        """Forward input from stdin to the server process"""
-        logger.info("Starting input processor thread")
+                moved = os.splice(stdin_fd, server_fd, CHUNK_SIZE, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            except BlockingIOError:
+                # stdin is readable, so the server's stdin is full
+                pause_input()
+                return True
+            except OSError as e:
+                if spliced:
+                    raise
+                logger.info(f"Cannot splice input ({e}), copying it instead")
+                use_splice = False
+            else:
+                spliced = True
+                return moved > 0
+                
+        chunk = os.read(stdin_fd, CHUNK_SIZE)
+        if not chunk:
+            return False
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Input: %r", chunk[:100])
+        pending.extend(chunk)
+        if not write_pending():
+            pause_input()
+        return True
+        
+    def write_pending() -> bool:
+        """Write as much pending input as the server takes, returning False if some is left"""
+        try:
+            while pending:
+                del pending[:os.write(server_fd, pending)]
+        except BlockingIOError:
+            return False
+        except Exception as e:
+            logger.error(f"Error forwarding input: {e}")
+            pending.clear()
+        return True
+    
+    def pause_input() -> None:
+        """Stop reading stdin until the server's stdin can take more, so output keeps draining meanwhile"""
+        selector.unregister(stdin_fd)
+        selector.register(server_fd, selectors.EVENT_WRITE, resume_input)
+        
+    def resume_input() -> bool:
+        """Write pending input once the server's stdin is writable, returning False when it is all written"""
+        if not write_pending():
+            return True
+        selector.register(stdin_fd, selectors.EVENT_READ, forward_input)
+        return False
+    
+    def forward_output() -> bool:
+        """Fix JSON in available server output, returning False once the server closes it"""
+        nonlocal extractor
+        chunk = os.read(process.stdout.fileno(), CHUNK_SIZE)
+        if not chunk:
+            stdout.write(b"".join(extractor.flush()))
+            stdout.flush()
+            logger.info("Output stream closed")
+            return False
+            
         try:
-            for line in sys.stdin:
-                try:
-                    logger.debug(f"Input: {line[:100]}")
-                    process.stdin.write(line)
-                    process.stdin.flush()
-                except Exception as e:
-                    logger.error(f"Error forwarding input: {e}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw output: %r", chunk[:100])
+            fixed_lines = extractor.feed(chunk)
+            if fixed_lines:
+                stdout.write(b"".join(fixed_lines))
+                stdout.flush()
         except Exception as e:
-            logger.error(f"Fatal error in input processing: {e}")
+            logger.error(f"Error processing output: {e}")
+            # Still try to write something
+            extractor = IncrementalJsonExtractor()
+            stdout.write(chunk)
+            stdout.flush()
+        return True
     
-    def process_errors():
-        """Log errors from the server"""
-        logger.info("Starting error processor thread")
-        for line in process.stderr:
-            logger.error(f"Server error: {line.strip()}")
+    def log_errors() -> bool:
+        """Log complete lines of server errors, returning False once the server closes stderr"""
+        try:
+            chunk = os.read(process.stderr.fileno(), CHUNK_SIZE)
+        except BlockingIOError:
+            return True
+        errors.extend(chunk)
+        lines = errors.split(b"\n")
+        errors[:] = lines.pop()
+        if not chunk and errors:
+            lines.append(bytes(errors))
+        for line in lines:
+            logger.error(f"Server error: {line.decode('utf-8', 'replace').strip()}")
+        return bool(chunk)
     
-    # Handle the server's output, input, and errors
-    import threading
-    output_thread = threading.Thread(target=process_output, daemon=True)
-    error_thread = threading.Thread(target=process_errors, daemon=True)
+    # One loop on the main thread serves input, output and errors as they become
+    # readable. poll rather than epoll, so stdin may also be a regular file.
+    selector = selectors.PollSelector()
+    selector.register(stdin_fd, selectors.EVENT_READ, forward_input)
+    selector.register(process.stdout, selectors.EVENT_READ, forward_output)
+    selector.register(process.stderr, selectors.EVENT_READ, log_errors)
     
-    output_thread.start()
-    error_thread.start()
+    # Server errors are only diagnostics, so a spurious wakeup on stderr must
+    # never stall the loop that carries the protocol traffic
+    os.set_blocking(process.stderr.fileno(), False)
     
     try:
-        process_input()
+        while selector.get_map():
+            for key, _ in selector.select():
+                if key.data():
+                    continue
+                selector.unregister(key.fileobj)
+                if key.fd == stdin_fd:
+                    # Stop the server but keep forwarding what it has already written
+                    logger.info("Input stream closed, terminating MCP server")
+                    process.terminate()
     except KeyboardInterrupt:
         logger.info("Received KeyboardInterrupt, shutting down")
+    except Exception as e:
+        logger.error(f"Fatal error forwarding MCP traffic: {e}")
     finally:
+        selector.close()
         logger.info("Terminating MCP server")
         process.terminate()
         try:
@@ -215,10 +386,6 @@ def main():
         except subprocess.TimeoutExpired:
             logger.warning("Process did not terminate in time, killing")
             process.kill()
-        
-        # Wait for threads to finish
-        output_thread.join(timeout=2)
-        error_thread.join(timeout=2)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,35 +1,60 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
 import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import json_dumps
 
-def retrieve_datasets_in_chunks(chunk_size=10, delay_seconds=1):
+API_URL = "https://api.stemformatics.org"
+
+# Shared HTTP session so paginated requests reuse one kept-alive connection
+SESSION = requests.Session()
+SESSION.mount(API_URL, HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+def iter_pages(base_url, params, offset_param, chunk_size, max_workers=4, delay_seconds=1):
+    """
+    Yield successive pages of a paginated endpoint in order, fetching up to
+    max_workers pages concurrently. The caller stops iterating at the last page.
+    
+    Args:
+        base_url: URL of the paginated endpoint
+        params: Query parameters sent with every page
+        offset_param: Name of the parameter holding the page offset
+        chunk_size: Number of items per page
+        max_workers: Maximum number of concurrent requests
+        delay_seconds: Delay between each round of requests to reduce server load
+    """
+    def fetch_page(offset):
+        response = SESSION.get(base_url, params={**params, offset_param: offset})
+        response.raise_for_status()  # Raise exception for HTTP errors
+        return response.json()
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        offset = 0
+        while True:
+            offsets = [offset + i * chunk_size for i in range(max_workers)]
+            yield from executor.map(fetch_page, offsets)
+            offset = offsets[-1] + chunk_size
+            
+            # Sleep to avoid overwhelming the server
+            time.sleep(delay_seconds)
+
+def retrieve_datasets_in_chunks(chunk_size=10, delay_seconds=1, max_workers=4):
     """
     Retrieve dataset information in manageable chunks
     
     Args:
         chunk_size: Number of datasets to retrieve per request
-        delay_seconds: Delay between requests to reduce server load
+        delay_seconds: Delay between rounds of requests to reduce server load
+        max_workers: Maximum number of concurrent requests
     """
-    base_url = "https://api.stemformatics.org/search/datasets"
-    
-    # Initial request to get all datasets (but with pagination)
-    params = {
-        "pagination_limit": chunk_size,
-        "pagination_start": 0
-    }
+    base_url = f"{API_URL}/search/datasets"
     
     all_datasets = []
     
-    while True:
-        print(f"Retrieving datasets {params['pagination_start']} to {params['pagination_start'] + params['pagination_limit']}...")
-        
-        try:
-            response = requests.get(base_url, params=params)
-            response.raise_for_status()  # Raise exception for HTTP errors
-            
-            # Get the data
-            datasets = response.json()
-            
+    try:
+        pages = iter_pages(base_url, {"pagination_limit": chunk_size}, "pagination_start",
+                           chunk_size, max_workers, delay_seconds)
+        for datasets in pages:
             # Check if we've reached the end
             if not datasets:
                 print("Reached the end of the dataset list.")
@@ -39,29 +64,23 @@ def retrieve_datasets_in_chunks(chunk_size=10, delay_seconds=1):
             all_datasets.extend(datasets)
             print(f"Retrieved {len(datasets)} datasets")
             
-            # Move to the next chunk
-            params["pagination_start"] += params["pagination_limit"]
-            
-            # Sleep to avoid overwhelming the server
-            time.sleep(delay_seconds)
-            
-        except Exception as e:
-            print(f"Error retrieving datasets: {e}")
-            break
+    except Exception as e:
+        print(f"Error retrieving datasets: {e}")
     
     print(f"Total datasets retrieved: {len(all_datasets)}")
     return all_datasets
 
-def retrieve_samples_for_dataset(dataset_id, chunk_size=20, delay_seconds=1):
+def retrieve_samples_for_dataset(dataset_id, chunk_size=20, delay_seconds=1, max_workers=4):
     """
     Retrieve samples for a specific dataset in chunks
     
     Args:
         dataset_id: ID of the dataset to retrieve samples for
         chunk_size: Number of samples to retrieve per request
-        delay_seconds: Delay between requests to reduce server load
+        delay_seconds: Delay between rounds of requests to reduce server load
+        max_workers: Maximum number of concurrent requests
     """
-    base_url = f"https://api.stemformatics.org/datasets/{dataset_id}/samples"
+    base_url = f"{API_URL}/datasets/{dataset_id}/samples"
     
     params = {
         "limit": chunk_size,
@@ -71,14 +90,9 @@ def retrieve_samples_for_dataset(dataset_id, chunk_size=20, delay_seconds=1):
     
     all_samples = []
     
-    while True:
-        try:
-            response = requests.get(base_url, params=params)
-            response.raise_for_status()  # Raise exception for HTTP errors
-            
-            # Get the data
-            samples = response.json()
-            
+    try:
+        # Pagination by offset may need adjustment based on the actual API behavior
+        for samples in iter_pages(base_url, params, "offset", chunk_size, max_workers, delay_seconds):
             # Check if we've reached the end
             if not samples:
                 print(f"Retrieved all samples for dataset {dataset_id}")
@@ -92,24 +106,16 @@ def retrieve_samples_for_dataset(dataset_id, chunk_size=20, delay_seconds=1):
             if len(samples) < chunk_size:
                 break
                 
-            # Move to the next chunk (implementation depends on API pagination)
-            # This may need adjustment based on the actual API behavior
-            params["offset"] = len(all_samples)
-            
-            # Sleep to avoid overwhelming the server
-            time.sleep(delay_seconds)
-            
-        except Exception as e:
-            print(f"Error retrieving samples for dataset {dataset_id}: {e}")
-            break
+    except Exception as e:
+        print(f"Error retrieving samples for dataset {dataset_id}: {e}")
     
     print(f"Total samples retrieved for dataset {dataset_id}: {len(all_samples)}")
     return all_samples
 
 def save_data_to_file(data, filename):
     """Save data to a JSON file"""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+    with open(filename, 'wb', buffering=65536) as f:
+        f.write(json_dumps(data, indent=True))
     print(f"Data saved to {filename}")
 
 if __name__ == "__main__":
@@ -8,15 +8,17 @@ It handles requests for dataset metadata, sample information, and gene expressio
 
 import os
 import sys
-import json
 import logging
 from typing import Dict, List, Optional, Any, Union
-import pandas as pd
-import numpy as np
-import requests
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
-from utils import setup_cache, validate_config
+from utils import setup_cache, load_config, BOOL_STR, with_optional
+from api_client import ApiClient, MetadataLoader
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional, the stdlib event loop is used without it
+    uvloop = None
 
 # Load environment variables and configuration
 load_dotenv()
@@ -32,26 +34,21 @@ logger = logging.getLogger("stemformatics-mcp")
 # Load configuration
 CONFIG_PATH = os.getenv("CONFIG_PATH", "config.json")
 try:
-    if os.path.exists(CONFIG_PATH):
-        with open(CONFIG_PATH, 'r') as f:
-            config = json.load(f)
-    else:
-        logger.warning(f"Config file not found at {CONFIG_PATH}, using example config")
-        with open("config.example.json", 'r') as f:
-            config = json.load(f)
-            
-    # Validate config
-    validate_config(config)
-    
+    config = load_config(CONFIG_PATH)
 except Exception as e:
     logger.error(f"Error loading configuration: {e}")
     sys.exit(1)
 
 # Initialize API client and cache
 cache = setup_cache(config)
-BASE_URL = config["api_server"]["base_url"]
-TIMEOUT = config["api_server"]["timeout"]
-API_KEY = config["auth"]["api_key"] if config["auth"]["use_auth"] else None
+API = ApiClient(config, cache)
+api_request = API.request
+api_request_async = API.request_async
+api_request_batched = API.request_batched
+memoize = API.memoize
+
+# Concurrent metadata lookups share one upstream batch request
+METADATA = MetadataLoader(API)
 
 # Initialize MCP server
 mcp = FastMCP(
@@ -59,52 +56,11 @@ mcp = FastMCP(
     description=config["server"]["description"]
 )
 
-def api_request(endpoint: str, method: str = "GET", params: Dict = None, data: Dict = None) -> Dict:
-    """Make a request to the Stemformatics API with proper error handling"""
-    headers = {"Authorization": f"Bearer {API_KEY}"} if API_KEY else {}
-    url = f"{BASE_URL}/{endpoint.lstrip('/')}"
-    
-    try:
-        # Check cache first if it's a GET request
-        if method == "GET" and config["cache"]["enabled"]:
-            cache_key = f"{url}_{str(params)}"
-            cached_result = cache.get(cache_key)
-            if cached_result is not None:
-                return cached_result
-        
-        # Make the request
-        response = requests.request(
-            method=method,
-            url=url,
-            params=params,
-            json=data,
-            headers=headers,
-            timeout=TIMEOUT
-        )
-        response.raise_for_status()
-        
-        # Handle different response types
-        if response.headers.get('content-type') == 'application/json':
-            result = response.json()
-        else:
-            # For raw file responses
-            result = {'content': response.text, 'is_file': True}
-        
-        # Cache the result if it's a GET request
-        if method == "GET" and config["cache"]["enabled"]:
-            cache_key = f"{url}_{str(params)}"
-            cache.set(cache_key, result)
-            
-        return result
-    
-    except requests.exceptions.RequestException as e:
-        logger.error(f"API request error: {e}")
-        return {"error": str(e)}
-
 # Tool definitions
 
 @mcp.tool()
-def get_dataset_metadata(dataset_id: str) -> Dict:
+@memoize
+async def get_dataset_metadata(dataset_id: str) -> Dict:
     """
     Get metadata for a specific dataset.
     
@@ -114,10 +70,10 @@ def get_dataset_metadata(dataset_id: str) -> Dict:
     Returns:
         Dictionary containing dataset metadata
     """
-    return api_request(f"datasets/{dataset_id}/metadata")
+    return await METADATA.load(dataset_id)
 
 @mcp.tool()
-def get_dataset_samples(dataset_id: str, orient: str = "records", as_file: bool = False) -> Dict:
+async def get_dataset_samples(dataset_id: str, orient: str = "records", as_file: bool = False) -> Dict:
     """
     Get samples for a specific dataset.
     
@@ -129,12 +85,13 @@ def get_dataset_samples(dataset_id: str, orient: str = "records", as_file: bool
     Returns:
         Dictionary containing sample information
     """
-    params = {"orient": orient, "as_file": str(as_file).lower()}
-    return api_request(f"datasets/{dataset_id}/samples", params=params)
+    params = {"orient": orient, "as_file": BOOL_STR[as_file]}
+    return await api_request_async(f"datasets/{dataset_id}/samples", params=params, stream=True)
 
 @mcp.tool()
-def get_dataset_expression(dataset_id: str, gene_id: Optional[str] = None, key: str = "cpm", 
-                           log2: bool = False, orient: str = "records", as_file: bool = False) -> Dict:
+async def get_dataset_expression(dataset_id: str, gene_id: Optional[str] = None, key: str = "cpm", 
+                                 log2: bool = False, orient: str = "records", as_file: bool = False,
+                                 gene_ids: Optional[List[str]] = None) -> Dict:
     """
     Get gene expression data for a dataset.
     
@@ -145,24 +102,30 @@ def get_dataset_expression(dataset_id: str, gene_id: Optional[str] = None, key:
         log2: Whether to return log2 values
         orient: Orientation of the data (records, list, dict, etc.)
         as_file: Whether to return the data as a file
+        gene_ids: Optional list of Ensembl gene IDs to filter by, fetched in concurrent batches
     
     Returns:
         Dictionary containing gene expression data
     """
     params = {
         "key": key,
-        "log2": str(log2).lower(),
+        "log2": BOOL_STR[log2],
         "orient": orient,
-        "as_file": str(as_file).lower()
+        "as_file": BOOL_STR[as_file]
     }
     
-    if gene_id:
-        params["gene_id"] = gene_id
+    # Files cannot be merged, so they are always requested in one go
+    if gene_ids and not as_file:
+        return await api_request_batched(
+            f"datasets/{dataset_id}/expression", params, "gene_id", gene_ids, stream=True, quantize=True
+        )
         
-    return api_request(f"datasets/{dataset_id}/expression", params=params)
+    params = with_optional(params, gene_id=",".join(gene_ids) if gene_ids else gene_id)
+    return await api_request_async(f"datasets/{dataset_id}/expression", params=params, stream=True,
+                                   quantize=True)
 
 @mcp.tool()
-def get_dataset_pca(dataset_id: str, orient: str = "records", dims: int = 20) -> Dict:
+async def get_dataset_pca(dataset_id: str, orient: str = "records", dims: int = 20) -> Dict:
     """
     Get PCA data for a dataset.
     
@@ -175,10 +138,10 @@ def get_dataset_pca(dataset_id: str, orient: str = "records", dims: int = 20) ->
         Dictionary containing PCA data
     """
     params = {"orient": orient, "dims": dims}
-    return api_request(f"datasets/{dataset_id}/pca", params=params)
+    return await api_request_async(f"datasets/{dataset_id}/pca", params=params, stream=True)
 
 @mcp.tool()
-def get_correlated_genes(dataset_id: str, gene_id: str, cutoff: int = 30) -> Dict:
+async def get_correlated_genes(dataset_id: str, gene_id: str, cutoff: int = 30) -> Dict:
     """
     Get genes correlated with a specific gene in a dataset.
     
@@ -191,11 +154,11 @@ def get_correlated_genes(dataset_id: str, gene_id: str, cutoff: int = 30) -> Dic
         Dictionary containing correlated genes
     """
     params = {"gene_id": gene_id, "cutoff": cutoff}
-    return api_request(f"datasets/{dataset_id}/correlated-genes", params=params)
+    return await api_request_async(f"datasets/{dataset_id}/correlated-genes", params=params)
 
 @mcp.tool()
-def perform_ttest(dataset_id: str, gene_id: str, sample_group: str, 
-                 sample_group_item1: str, sample_group_item2: str) -> Dict:
+async def perform_ttest(dataset_id: str, gene_id: str, sample_group: str, 
+                       sample_group_item1: str, sample_group_item2: str) -> Dict:
     """
     Perform t-test for a gene between two sample groups.
     
@@ -215,10 +178,10 @@ def perform_ttest(dataset_id: str, gene_id: str, sample_group: str,
         "sample_group_item1": sample_group_item1,
         "sample_group_item2": sample_group_item2
     }
-    return api_request(f"datasets/{dataset_id}/ttest", params=params)
+    return await api_request_async(f"datasets/{dataset_id}/ttest", params=params)
 
 @mcp.tool()
-def search_datasets(query_string: Optional[str] = None) -> Dict:
+async def search_datasets(query_string: Optional[str] = None) -> Dict:
     """
     Search for datasets.
     
@@ -228,15 +191,12 @@ def search_datasets(query_string: Optional[str] = None) -> Dict:
     Returns:
         Dictionary containing dataset search results
     """
-    params = {}
-    if query_string:
-        params["query_string"] = query_string
-        
-    return api_request("search/datasets", params=params)
+    params = with_optional({}, query_string=query_string)
+    return await api_request_async("search/datasets", params=params)
 
 @mcp.tool()
-def search_samples(query_string: Optional[str] = None, field: Optional[str] = None, 
-                   limit: int = 50, orient: str = "records") -> Dict:
+async def search_samples(query_string: Optional[str] = None, field: Optional[str] = None, 
+                         limit: int = 50, orient: str = "records") -> Dict:
     """
     Search for samples.
     
@@ -249,18 +209,12 @@ def search_samples(query_string: Optional[str] = None, field: Optional[str] = No
     Returns:
         Dictionary containing sample search results
     """
-    params = {"limit": limit, "orient": orient}
-    
-    if query_string:
-        params["query_string"] = query_string
-    
-    if field:
-        params["field"] = field
-        
-    return api_request("search/samples", params=params)
+    params = with_optional({"limit": limit, "orient": orient}, query_string=query_string, field=field)
+    return await api_request_async("search/samples", params=params)
 
 @mcp.tool()
-def get_dataset_values(key: str, include_count: bool = False) -> Dict:
+@memoize
+async def get_dataset_values(key: str, include_count: bool = False) -> Dict:
     """
     Get unique values for a specific key across all datasets.
     
@@ -271,11 +225,12 @@ def get_dataset_values(key: str, include_count: bool = False) -> Dict:
     Returns:
         Dictionary containing values
     """
-    params = {"include_count": str(include_count).lower()}
-    return api_request(f"values/datasets/{key}", params=params)
+    params = {"include_count": BOOL_STR[include_count]}
+    return await api_request_async(f"values/datasets/{key}", params=params)
 
 @mcp.tool()
-def get_sample_values(key: str, include_count: bool = False) -> Dict:
+@memoize
+async def get_sample_values(key: str, include_count: bool = False) -> Dict:
     """
     Get unique values for a specific key across all samples.
     
@@ -286,11 +241,11 @@ def get_sample_values(key: str, include_count: bool = False) -> Dict:
     Returns:
         Dictionary containing values
     """
-    params = {"include_count": str(include_count).lower()}
-    return api_request(f"values/samples/{key}", params=params)
+    params = {"include_count": BOOL_STR[include_count]}
+    return await api_request_async(f"values/samples/{key}", params=params)
 
 @mcp.tool()
-def download_datasets(dataset_ids: List[str]) -> Dict:
+async def download_datasets(dataset_ids: List[str]) -> Dict:
     """
     Download datasets.
     
@@ -301,10 +256,10 @@ def download_datasets(dataset_ids: List[str]) -> Dict:
         Dictionary containing download information
     """
     params = {"dataset_id": ",".join(map(str, dataset_ids))}
-    return api_request("download", params=params)
+    return await api_request_async("download", params=params)
 
 @mcp.tool()
-def get_sample_group_to_genes(sample_group: str, sample_group_item: str, cutoff: int = 10) -> Dict:
+async def get_sample_group_to_genes(sample_group: str, sample_group_item: str, cutoff: int = 10) -> Dict:
     """
     Get genes associated with a sample group.
     
@@ -321,10 +276,10 @@ def get_sample_group_to_genes(sample_group: str, sample_group_item: str, cutoff:
         "sample_group_item": sample_group_item,
         "cutoff": cutoff
     }
-    return api_request("genes/sample-group-to-genes", params=params)
+    return await api_request_async("genes/sample-group-to-genes", params=params)
 
 @mcp.tool()
-def get_gene_to_sample_groups(gene_id: str, sample_group: str = "cell_type") -> Dict:
+async def get_gene_to_sample_groups(gene_id: str, sample_group: str = "cell_type") -> Dict:
     """
     Get sample groups associated with a gene.
     
@@ -336,21 +291,22 @@ def get_gene_to_sample_groups(gene_id: str, sample_group: str = "cell_type") ->
         Dictionary containing sample group information
     """
     params = {"gene_id": gene_id, "sample_group": sample_group}
-    return api_request("genes/gene-to-sample-groups", params=params)
+    return await api_request_async("genes/gene-to-sample-groups", params=params)
 
 @mcp.tool()
-def get_atlas_types() -> Dict:
+@memoize
+async def get_atlas_types() -> Dict:
     """
     Get available atlas types.
     
     Returns:
         Dictionary containing atlas type information
     """
-    return api_request("atlas-types")
+    return await api_request_async("atlas-types")
 
 @mcp.tool()
-def get_atlas(atlas_type: str, item: str, version: str = "", orient: str = "records", 
-              filtered: bool = False, query_string: str = "", gene_id: str = "", as_file: bool = False) -> Dict:
+async def get_atlas(atlas_type: str, item: str, version: str = "", orient: str = "records", 
+                    filtered: bool = False, query_string: str = "", gene_id: str = "", as_file: bool = False) -> Dict:
     """
     Get atlas data.
     
@@ -370,20 +326,15 @@ def get_atlas(atlas_type: str, item: str, version: str = "", orient: str = "reco
     params = {
         "version": version,
         "orient": orient,
-        "filtered": str(filtered).lower(),
-        "as_file": str(as_file).lower()
+        "filtered": BOOL_STR[filtered],
+        "as_file": BOOL_STR[as_file]
     }
-    
-    if query_string:
-        params["query_string"] = query_string
-    
-    if gene_id:
-        params["gene_id"] = gene_id
-        
-    return api_request(f"atlases/{atlas_type}/{item}", params=params)
+    params = with_optional(params, query_string=query_string, gene_id=gene_id)
+    return await api_request_async(f"atlases/{atlas_type}/{item}", params=params)
 
 @mcp.tool()
-def get_atlas_projection(atlas_type: str, data_source: str) -> Dict:
+@memoize
+async def get_atlas_projection(atlas_type: str, data_source: str) -> Dict:
     """
     Get atlas projection data.
     
@@ -394,39 +345,41 @@ def get_atlas_projection(atlas_type: str, data_source: str) -> Dict:
     Returns:
         Dictionary containing atlas projection data
     """
-    return api_request(f"atlas-projection/{atlas_type}/{data_source}")
+    return await api_request_async(f"atlas-projection/{atlas_type}/{data_source}")
 
 # Resources
 
 @mcp.resource("datasets://{dataset_id}/metadata")
-def get_dataset_metadata_resource(dataset_id: str) -> Dict:
+@memoize
+async def get_dataset_metadata_resource(dataset_id: str) -> Dict:
     """Get metadata for a specific dataset"""
-    return api_request(f"datasets/{dataset_id}/metadata")
+    return await METADATA.load(dataset_id)
 
 @mcp.resource("datasets://{dataset_id}/samples")
-def get_dataset_samples_resource(dataset_id: str) -> Dict:
+async def get_dataset_samples_resource(dataset_id: str) -> Dict:
     """Get samples for a specific dataset"""
-    return api_request(f"datasets/{dataset_id}/samples")
+    return await api_request_async(f"datasets/{dataset_id}/samples")
 
 @mcp.resource("datasets://{dataset_id}/expression")
-def get_dataset_expression_resource(dataset_id: str) -> Dict:
+async def get_dataset_expression_resource(dataset_id: str) -> Dict:
     """Get expression data for a specific dataset"""
-    return api_request(f"datasets/{dataset_id}/expression")
+    return await api_request_async(f"datasets/{dataset_id}/expression")
 
 @mcp.resource("search://datasets")
-def search_datasets_resource() -> Dict:
+async def search_datasets_resource() -> Dict:
     """Search for datasets"""
-    return api_request("search/datasets")
+    return await api_request_async("search/datasets")
 
 @mcp.resource("search://samples")
-def search_samples_resource() -> Dict:
+async def search_samples_resource() -> Dict:
     """Search for samples"""
-    return api_request("search/samples")
+    return await api_request_async("search/samples")
 
 @mcp.resource("atlas://types")
-def get_atlas_types_resource() -> Dict:
+@memoize
+async def get_atlas_types_resource() -> Dict:
     """Get atlas types"""
-    return api_request("atlas-types")
+    return await api_request_async("atlas-types")
 
 if __name__ == "__main__":
     logger.info(f"Starting Stemformatics MCP Server with config from {CONFIG_PATH}")
@@ -443,6 +396,11 @@ if __name__ == "__main__":
     
     logger.info(f"Using transport: {transport}")
     
+    # Run the event loop on uvloop when it is installed, unless MCP_LOOP=asyncio
+    if uvloop is not None and os.getenv("MCP_LOOP", "uvloop") == "uvloop":
+        uvloop.install()
+        logger.info("Using uvloop event loop")
+    
     try:
         # Let the MCP library handle transport configuration internally
         mcp.run(transport=transport)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 # Try a simple API request
 base_url = "https://api.stemformatics.org"
@@ -13,15 +14,31 @@ endpoints = [
     "/search/samples?limit=5"
 ]
 
-print("Testing Stemformatics API connectivity...")
-for endpoint in endpoints:
+def probe(endpoint):
+    """Request one endpoint, returning its URL and the response or the error raised"""
+    url = f"{base_url}{endpoint}"
     try:
-        url = f"{base_url}{endpoint}"
-        print(f"\nTrying: {url}")
-        response = requests.get(url, timeout=10)
+        return url, session.get(url, timeout=10)
+    except Exception as e:
+        return url, e
+
+print("Testing Stemformatics API connectivity...")
+
+# Probe all endpoints at once over one pooled session, then report in order
+session = requests.Session()
+with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+    results = list(executor.map(probe, endpoints))
+
+for url, response in results:
+    print(f"\nTrying: {url}")
+    if isinstance(response, Exception):
+        print(f"ERROR: {str(response)}")
+        continue
         
+    try:
         if response.status_code == 200:
             print(f"SUCCESS: Status code {response.status_code}")
+            print(f"Content encoding: {response.headers.get('content-encoding', 'identity')}")
             # Print a small preview of the response
             if response.headers.get('content-type') == 'application/json':
                 data = response.json()
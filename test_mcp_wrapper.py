@@ -0,0 +1,38 @@
+from mcp_wrapper import IncrementalJsonExtractor
+
+def extract(data, step=None):
+    """Feed data to a new extractor, step bytes at a time, and return the lines it produces"""
+    extractor = IncrementalJsonExtractor()
+    step = step or len(data)
+    lines = []
+    for i in range(0, len(data), step):
+        lines += extractor.feed(data[i:i + step])
+    return lines + extractor.flush()
+
+def test_extracts_objects_from_noisy_lines():
+    """Test that objects are pulled out of lines mixed with other output"""
+    assert extract(b'log {"a": {"b": "}\\" {"}} tail {"c": 2}\n') == [b'{"a": {"b": "}\\" {"}}\n', b'{"c": 2}\n']
+    assert extract(b'plain text\n') == [b'plain text\n']
+
+def test_forwards_batches_unchanged():
+    """Test that a JSON-RPC batch is not split into its objects"""
+    line = b'[{"jsonrpc": "2.0", "id": 1, "result": {}}, {"jsonrpc": "2.0", "id": 2, "result": {}}]\n'
+    for step in (1, 7, None):
+        assert extract(line, step) == [line]
+
+def test_forwards_json_strings_unchanged():
+    """Test that a JSON string holding braces is not mistaken for an object"""
+    assert extract(b'"{}"\n') == [b'"{}"\n']
+    assert extract(b'  "a {\\"b\\": 1} c"\n') == [b'  "a {\\"b\\": 1} c"\n']
+
+def test_forwards_clean_frames_unchanged():
+    """Test that a line holding one object is forwarded byte for byte"""
+    assert extract(b'{"a": 1}\r\n') == [b'{"a": 1}\r\n']
+    assert extract(b' {"a": [1, "}"]}') == [b' {"a": [1, "}"]}']
+
+if __name__ == "__main__":
+    test_extracts_objects_from_noisy_lines()
+    test_forwards_batches_unchanged()
+    test_forwards_json_strings_unchanged()
+    test_forwards_clean_frames_unchanged()
+    print("Test succeeded")
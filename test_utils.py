@@ -0,0 +1,62 @@
+import zlib
+from utils import merge_results, RedisCache
+
+def make_batches(orient, genes, samples):
+    """Build the results one request per batch of genes returns in an orient"""
+    batches = [genes[i:i + 200] for i in range(0, len(genes), 200)]
+    if orient == "list":
+        return [{s: [1.0 for _ in batch] for s in samples} for batch in batches]
+    if orient == "split":
+        return [{"index": batch, "columns": samples, "data": [[1.0] * len(samples) for _ in batch]} for batch in batches]
+    if orient == "index":
+        return [{g: {s: 1.0 for s in samples} for g in batch} for batch in batches]
+    if orient == "columns":
+        return [{s: {g: 1.0 for g in batch} for s in samples} for batch in batches]
+    return [[{s: 1.0 for s in samples} for _ in batch] for batch in batches]
+
+def test_merge_results():
+    """Test that batched results merge back to every gene in each orient"""
+    genes = [f"g{i}" for i in range(450)]
+    samples = ["s1", "s2"]
+    
+    merged = merge_results(make_batches("list", genes, samples))
+    assert all(len(merged[s]) == len(genes) for s in samples)
+    
+    merged = merge_results(make_batches("split", genes, samples))
+    assert merged["index"] == genes
+    assert len(merged["data"]) == len(genes)
+    assert merged["columns"] == samples
+    
+    assert len(merge_results(make_batches("index", genes, samples))) == len(genes)
+    assert all(len(column) == len(genes) for column in merge_results(make_batches("columns", genes, samples)).values())
+    assert len(merge_results(make_batches("records", genes, samples))) == len(genes)
+    
+    assert merge_results([{"a": [1]}, {"error": "failed"}]) == {"error": "failed"}
+
+class StubRedis:
+    """Stands in for a Redis client that returns a fixed blob for every key"""
+    
+    def __init__(self, blob):
+        self.blob = blob
+        
+    def get(self, key):
+        return self.blob
+
+def test_redis_cache_corrupt_entry():
+    """Test that an entry that fails to decompress or parse is treated as a miss"""
+    cache = RedisCache.__new__(RedisCache)
+    cache.prefix = "test:"
+    
+    for blob in (b"z" + b"not zlib data", b"z" + zlib.compress(b"{not json"), b"{not json"):
+        cache.client = StubRedis(blob)
+        assert cache.get("key") is None
+        assert cache.get_stale("key") is None
+        cache.refresh("key")
+        
+    cache.client = StubRedis(b"z" + zlib.compress(b'{"value": 1, "expires": 1e12, "validators": null}'))
+    assert cache.get("key") == 1
+
+if __name__ == "__main__":
+    test_merge_results()
+    test_redis_cache_corrupt_entry()
+    print("Test succeeded")
@@ -4,95 +4,559 @@ Utility functions for the Stemformatics MCP Server.
 
 import os
 import sys
+import time
 import logging
 import json
-from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
+import zlib
+import hashlib
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Union, Callable, Hashable, Tuple, Mapping
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to msgspec or the stdlib codec
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec is optional, used when orjson is not installed
+    msgspec = None
+
+try:
+    import redis
+except ImportError:  # redis is only needed for the shared cache backend
+    redis = None
 
 logger = logging.getLogger("stemformatics-mcp")
 
+def json_loads(data: Union[str, bytes, bytearray]) -> Any:
+    """Decode JSON from str or bytes, using orjson or msgspec when one is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+def json_dumps(value: Any, indent: bool = False) -> bytes:
+    """
+    Encode a value to UTF-8 JSON bytes, using orjson or msgspec when one is installed.
+    Output is compact unless indent is true, in which case it is indented by two spaces.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 if indent else None)
+    if msgspec is not None:
+        encoded = msgspec.json.encode(value)
+        return msgspec.json.format(encoded, indent=2) if indent else encoded
+    if indent:
+        return json.dumps(value, indent=2).encode("utf-8")
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+def make_cache_key(url: str, params: Optional[Dict] = None) -> tuple:
+    """
+    Build a hashable cache key for a request from its URL and query parameters.
+    Parameters are sorted so the key does not depend on dict insertion order.
+    """
+    if not params:
+        return (url, ())
+    return (url, tuple(sorted(
+        (name, tuple(value) if isinstance(value, list) else value)
+        for name, value in params.items()
+    )))
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one: the first caller
+    runs the call, and callers arriving while it is in flight wait for and
+    share its result instead of repeating it.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Run func for key, or wait for the call already running for key"""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+                
+        if not leader:
+            return future.result()
+            
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+def ttl_cache(maxsize: int = 1024, ttl: int = 300) -> Callable:
+    """
+    Memoize a function or coroutine function on its arguments for up to `ttl`
+    seconds, keeping at most `maxsize` results in least-recently-used order.
+    
+    List arguments are keyed as tuples. API error responses ({"error": ...})
+    are not memoized, and calls with other unhashable arguments are passed
+    straight through.
+    """
+    def decorator(func: Callable) -> Callable:
+        entries = OrderedDict()
+        lock = threading.Lock()
+        
+        def make_key(args: tuple, kwargs: Dict) -> Hashable:
+            freeze = lambda value: tuple(value) if isinstance(value, list) else value
+            key = (tuple(map(freeze, args)), tuple(sorted((k, freeze(v)) for k, v in kwargs.items())))
+            hash(key)
+            return key
+            
+        def lookup(key: Hashable, now: float) -> Any:
+            with lock:
+                entry = entries.get(key)
+                if entry is not None and entry[0] > now:
+                    entries.move_to_end(key)
+                    return entry
+            return None
+            
+        def store(key: Hashable, now: float, result: Any) -> None:
+            if isinstance(result, dict) and "error" in result:
+                return
+            with lock:
+                entries[key] = (now + ttl, result)
+                entries.move_to_end(key)
+                while len(entries) > maxsize:
+                    entries.popitem(last=False)
+                    
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                try:
+                    key = make_key(args, kwargs)
+                except TypeError:
+                    return await func(*args, **kwargs)
+                now = time.monotonic()
+                entry = lookup(key, now)
+                if entry is not None:
+                    return entry[1]
+                result = await func(*args, **kwargs)
+                store(key, now, result)
+                return result
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                try:
+                    key = make_key(args, kwargs)
+                except TypeError:
+                    return func(*args, **kwargs)
+                now = time.monotonic()
+                entry = lookup(key, now)
+                if entry is not None:
+                    return entry[1]
+                result = func(*args, **kwargs)
+                store(key, now, result)
+                return result
+                
+        wrapper.cache_clear = entries.clear
+        return wrapper
+        
+    return decorator
+
+def response_validators(headers: Mapping[str, str]) -> Optional[Dict[str, str]]:
+    """Extract the ETag and Last-Modified validators of a response, if it has any"""
+    validators = {}
+    if headers.get("ETag"):
+        validators["etag"] = headers["ETag"]
+    if headers.get("Last-Modified"):
+        validators["last_modified"] = headers["Last-Modified"]
+    return validators or None
+
+def conditional_headers(validators: Dict[str, str]) -> Dict[str, str]:
+    """Build the headers that revalidate a cached response with a conditional GET"""
+    headers = {}
+    if "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if "last_modified" in validators:
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+# Query string spelling of boolean API parameters
+BOOL_STR = {True: "true", False: "false"}
+
+def merge_results(results: List[Any]) -> Any:
+    """
+    Merge the results of requests that each covered a batch of the same query.
+    Lists of records are concatenated and mappings are combined key by key,
+    concatenating list values and merging nested mappings one level deep.
+    Split-oriented results ({"index", "columns", "data"}) keep one copy of
+    their shared columns. The first error result wins.
+    """
+    for result in results:
+        if isinstance(result, dict) and "error" in result:
+            return result
+            
+    if all(isinstance(result, list) for result in results):
+        return [record for result in results for record in result]
+        
+    merged = {}
+    for result in results:
+        for key, value in result.items():
+            current = merged.get(key)
+            if isinstance(value, dict) and isinstance(current, dict):
+                merged[key] = {**current, **value}
+            elif isinstance(value, list) and isinstance(current, list) and not (key == "columns" and "data" in result):
+                # Split columns are the same in every batch, anything else is a slice of rows
+                merged[key] = current + value
+            else:
+                merged[key] = value
+    return merged
+
+def with_optional(params: Dict, **optional: Any) -> Dict:
+    """Add the optional query parameters that were given a non-empty value"""
+    params.update((name, value) for name, value in optional.items() if value)
+    return params
+
+# Cache storage types for expression matrices; "f64" keeps payloads as-is
+EXPRESSION_DTYPES = ("f64", "f32", "f16", "i8")
+
+# Largest magnitude representable in float16, and the int8 code for a missing value
+_F16_MAX = 65504.0
+_I8_MISSING = -128
+
+class PackedExpression:
+    """
+    An expression payload held in the cache as a compact numeric matrix.
+    
+    Supports records-oriented payloads (a list of {column: value} rows) and
+    index-oriented payloads ({row: {column: value}}) whose values are all
+    numbers or null. Values are stored as float32, float16 or int8 with a
+    per-row scale, and are restored as floats on unpack.
+    """
+    
+    def __init__(self, row_keys: Optional[list], columns: list, values: Any, scale: Any = None):
+        self.row_keys = row_keys
+        self.columns = columns
+        self.values = values
+        self.scale = scale
+        
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the packed payload"""
+        size = self.values.nbytes
+        if self.scale is not None:
+            size += self.scale.nbytes
+        size += sum(len(str(c)) for c in self.columns)
+        size += sum(len(str(k)) for k in self.row_keys or ())
+        return size
+        
+    @classmethod
+    def pack(cls, payload: Any, dtype: str) -> Optional["PackedExpression"]:
+        """Pack a payload as dtype, or return None if it is not a numeric matrix"""
+        if isinstance(payload, list):
+            row_keys, rows = None, payload
+        elif isinstance(payload, dict):
+            row_keys, rows = list(payload), list(payload.values())
+        else:
+            return None
+            
+        if not rows or not isinstance(rows[0], dict):
+            return None
+        columns = list(rows[0])
+        for row in rows:
+            if not isinstance(row, dict) or row.keys() != rows[0].keys():
+                return None
+            for value in row.values():
+                if value is not None and type(value) not in (int, float):
+                    return None
+                    
+        import numpy as np
+        
+        matrix = np.array([[row[c] for c in columns] for row in rows], dtype=np.float32)
+        scale = None
+        if dtype == "f16" and np.nanmax(np.abs(matrix), initial=0.0) <= _F16_MAX:
+            matrix = matrix.astype(np.float16)
+        elif dtype == "i8":
+            missing = np.isnan(matrix)
+            filled = np.where(missing, 0.0, matrix)
+            scale = np.abs(filled).max(axis=1) / 127
+            scale[scale == 0] = 1.0
+            quantized = np.round(filled / scale[:, None]).astype(np.int8)
+            quantized[missing] = _I8_MISSING
+            matrix = quantized
+            
+        return cls(row_keys, columns, matrix, scale)
+        
+    def unpack(self) -> Any:
+        """Restore the payload in its original orientation"""
+        import numpy as np
+        
+        matrix = self.values.astype(np.float32)
+        if self.scale is not None:
+            matrix[self.values == _I8_MISSING] = np.nan
+            matrix *= self.scale[:, None]
+            
+        rows = [
+            dict(zip(self.columns, [None if v != v else v for v in row]))
+            for row in matrix.tolist()
+        ]
+        if self.row_keys is None:
+            return rows
+        return dict(zip(self.row_keys, rows))
+
+# Cached JSON values at least this large are stored zlib-compressed
+COMPRESS_MIN_BYTES = 4096
+
+# Seconds between background sweeps of expired cache entries
+SWEEP_SECONDS = 60
+
+def approx_size(value: Any) -> int:
+    """Estimate the bytes a JSON-like value takes, without serializing it"""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if value is None or isinstance(value, (int, float)):
+        return 8
+    if isinstance(value, dict):
+        return 48 + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 32 + sum(approx_size(v) for v in value)
+    return sys.getsizeof(value)
+
 class SimpleCache:
-    """A simple in-memory cache with TTL support"""
+    """
+    A simple in-memory cache with TTL support, evicting least recently used entries first.
+    With compress set, large JSON values are held compressed and decoded on every hit.
+    
+    The cache is safe to share between threads. Unless sweep_seconds is 0, a
+    daemon thread removes expired entries periodically, so they stop counting
+    against max_size_mb without waiting to be looked up again.
+    """
     
-    def __init__(self, ttl_seconds: int = 3600, max_size_mb: int = 100):
-        self.cache = {}
+    def __init__(self, ttl_seconds: int = 3600, max_size_mb: int = 100, compress: bool = True,
+                 sweep_seconds: int = SWEEP_SECONDS):
+        self.cache = OrderedDict()
         self.ttl_seconds = ttl_seconds
         self.max_size_mb = max_size_mb
+        self.compress = compress
         self.current_size_bytes = 0
+        self.lock = threading.RLock()
         
-    def get(self, key: str) -> Optional[Any]:
+        if sweep_seconds:
+            threading.Thread(
+                target=self._sweep_forever, args=(sweep_seconds,), name="cache-sweeper", daemon=True
+            ).start()
+        
+    def get(self, key: Hashable) -> Optional[Any]:
         """Get a value from the cache if it exists and hasn't expired"""
-        if key not in self.cache:
-            return None
-            
-        entry = self.cache[key]
-        if datetime.now() > entry["expires"]:
-            # Remove expired entry
-            self._remove_entry(key)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+                
+            if time.monotonic() > entry["expires"]:
+                # Remove expired entry, unless it can still be revalidated
+                if not entry["validators"]:
+                    self._remove_entry(key)
+                return None
+                
+            self.cache.move_to_end(key)
+        return self._value(entry)
+        
+    def get_stale(self, key: Hashable) -> Optional[Tuple[Any, Dict[str, str]]]:
+        """Get a value and its validators, even if expired, if it can be revalidated"""
+        entry = self.cache.get(key)
+        if entry is None or not entry["validators"]:
             return None
-            
-        return entry["value"]
+        return self._value(entry), entry["validators"]
         
-    def set(self, key: str, value: Any) -> bool:
-        """Set a value in the cache with the configured TTL"""
-        # Roughly estimate the size of the value
-        try:
-            value_size = len(json.dumps(value).encode("utf-8"))
-        except:
-            value_size = sys.getsizeof(value)
-            
-        # Check if adding this would exceed max cache size
-        if key in self.cache:
-            old_size = len(json.dumps(self.cache[key]["value"]).encode("utf-8"))
-            size_diff = value_size - old_size
-            new_total = self.current_size_bytes + size_diff
+    def refresh(self, key: Hashable) -> None:
+        """Restart the TTL of an entry the server has confirmed is unchanged"""
+        with self.lock:
+            if key in self.cache:
+                self.cache[key]["expires"] = time.monotonic() + self.ttl_seconds
+                self.cache.move_to_end(key)
+                
+    def sweep(self) -> int:
+        """Remove expired entries that cannot be revalidated, returning how many were removed"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                key for key, entry in self.cache.items()
+                if now > entry["expires"] and not entry["validators"]
+            ]
+            for key in expired:
+                self._remove_entry(key)
+        return len(expired)
+        
+    def _sweep_forever(self, interval: int) -> None:
+        """Sweep the cache every interval seconds"""
+        while True:
+            time.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug("Swept %d expired cache entries", removed)
+        
+    def set(self, key: Hashable, value: Any, validators: Optional[Dict[str, str]] = None) -> bool:
+        """
+        Set a value in the cache with the configured TTL.
+        Entries stored with validators are kept after expiry until evicted,
+        so they can be revalidated with a conditional request.
+        """
+        # Roughly estimate the size of the value, encoding it only when it may be compressed
+        stored, compressed = value, False
+        if isinstance(value, PackedExpression):
+            value_size = value.nbytes
+        elif not self.compress:
+            value_size = approx_size(value)
         else:
-            new_total = self.current_size_bytes + value_size
+            try:
+                encoded = json_dumps(value)
+            except (TypeError, ValueError) as e:
+                logger.debug(f"Caching a value that cannot be encoded as JSON uncompressed: {e}")
+                value_size = approx_size(value)
+            else:
+                value_size = len(encoded)
+                if value_size >= COMPRESS_MIN_BYTES:
+                    stored, compressed = zlib.compress(encoded, 1), True
+                    value_size = len(stored)
             
-        max_bytes = self.max_size_mb * 1024 * 1024
-        if new_total > max_bytes:
-            # Need to evict some entries
-            self._evict(new_total - max_bytes)
+        with self.lock:
+            # Replace any existing entry, so its recorded size stops counting
+            self._remove_entry(key)
             
-        # Add the new entry
-        self.cache[key] = {
-            "value": value,
-            "expires": datetime.now() + timedelta(seconds=self.ttl_seconds),
-            "size": value_size
-        }
-        
-        # Update current size
-        if key in self.cache:
-            old_size = self.cache[key].get("size", 0)
-            self.current_size_bytes = self.current_size_bytes - old_size + value_size
-        else:
+            # Check if adding this would exceed max cache size
+            new_total = self.current_size_bytes + value_size
+            max_bytes = self.max_size_mb * 1024 * 1024
+            if new_total > max_bytes:
+                # Need to evict some entries
+                self._evict(new_total - max_bytes)
+                
+            # Add the new entry
+            self.cache[key] = {
+                "value": stored,
+                "compressed": compressed,
+                "expires": time.monotonic() + self.ttl_seconds,
+                "size": value_size,
+                "validators": validators
+            }
             self.current_size_bytes += value_size
-            
         return True
         
-    def _remove_entry(self, key: str) -> None:
+    def _value(self, entry: Dict) -> Any:
+        """Return the value of an entry, decompressing it if needed"""
+        if entry["compressed"]:
+            return json_loads(zlib.decompress(entry["value"]))
+        return entry["value"]
+        
+    def _remove_entry(self, key: Hashable) -> None:
         """Remove an entry from the cache"""
         if key in self.cache:
             self.current_size_bytes -= self.cache[key].get("size", 0)
             del self.cache[key]
             
     def _evict(self, bytes_to_free: int) -> None:
-        """Evict entries to free up space"""
-        # Sort by expiration time, oldest first
-        sorted_entries = sorted(
-            [(k, v["expires"]) for k, v in self.cache.items()],
-            key=lambda x: x[1]
-        )
-        
+        """Evict least recently used entries to free up space"""
         bytes_freed = 0
-        for key, _ in sorted_entries:
-            if bytes_freed >= bytes_to_free:
-                break
-                
-            entry_size = self.cache[key].get("size", 0)
-            self._remove_entry(key)
-            bytes_freed += entry_size
+        while bytes_freed < bytes_to_free and self.cache:
+            _, entry = self.cache.popitem(last=False)
+            self.current_size_bytes -= entry["size"]
+            bytes_freed += entry["size"]
+            
+class RedisCache:
+    """
+    A cache shared by every server process through Redis, with the same
+    interface as SimpleCache.
+    
+    Entries are stored as JSON, compressed like SimpleCache's large values,
+    and expire in Redis with the configured TTL. Entries with validators are
+    kept for stale_ttl_seconds instead, so they can be revalidated with a
+    conditional request after their TTL. Redis errors and entries that fail
+    to decode are logged and treated as misses, so an unreachable server or
+    a corrupt entry only costs cache hits.
+    """
+    
+    def __init__(self, url: str, ttl_seconds: int = 3600, compress: bool = True, prefix: str = "stemformatics:",
+                 stale_ttl_seconds: Optional[int] = None):
+        if redis is None:
+            raise ImportError("The redis cache backend requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.stale_ttl_seconds = max(stale_ttl_seconds or 0, ttl_seconds)
+        self.compress = compress
+        self.prefix = prefix
+        
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get a value from the cache if it exists and hasn't expired"""
+        entry = self._load(key)
+        if entry is None or time.time() > entry["expires"]:
+            return None
+        return entry["value"]
+        
+    def get_stale(self, key: Hashable) -> Optional[Tuple[Any, Dict[str, str]]]:
+        """Get a value and its validators, even if expired, if it can be revalidated"""
+        entry = self._load(key)
+        if entry is None or not entry["validators"]:
+            return None
+        return entry["value"], entry["validators"]
+        
+    def refresh(self, key: Hashable) -> None:
+        """Restart the TTL of an entry the server has confirmed is unchanged"""
+        entry = self._load(key)
+        if entry is not None:
+            self.set(key, entry["value"], entry["validators"])
+            
+    def set(self, key: Hashable, value: Any, validators: Optional[Dict[str, str]] = None) -> bool:
+        """Set a value in the cache with the configured TTL"""
+        if isinstance(value, PackedExpression):
+            value = value.unpack()
+        try:
+            blob = json_dumps({
+                "value": value,
+                "expires": time.time() + self.ttl_seconds,
+                "validators": validators
+            })
+        except TypeError as e:
+            logger.debug(f"Not caching a value that cannot be stored as JSON: {e}")
+            return False
             
+        if self.compress and len(blob) >= COMPRESS_MIN_BYTES:
+            blob = b"z" + zlib.compress(blob, 1)
+        try:
+            self.client.set(self._redis_key(key), blob, ex=self.stale_ttl_seconds if validators else self.ttl_seconds)
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache write failed: {e}")
+            return False
+        return True
+        
+    def _load(self, key: Hashable) -> Optional[Dict]:
+        """Fetch and decode the stored entry for key"""
+        try:
+            blob = self.client.get(self._redis_key(key))
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache read failed: {e}")
+            return None
+        if blob is None:
+            return None
+        try:
+            if blob[:1] == b"z":
+                blob = zlib.decompress(blob[1:])
+            return json_loads(blob)
+        except (zlib.error, ValueError) as e:
+            logger.warning(f"Ignoring corrupt Redis cache entry: {e}")
+            return None
+        
+    def _redis_key(self, key: Hashable) -> str:
+        """Map a cache key to a fixed-length Redis key"""
+        return self.prefix + hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).hexdigest()
+
 def validate_config(config: Dict) -> bool:
     """
     Validate the configuration dictionary.
@@ -122,6 +586,20 @@ def validate_config(config: Dict) -> bool:
         config["cache"]["ttl_seconds"] = 3600
     if "max_size_mb" not in config["cache"]:
         config["cache"]["max_size_mb"] = 100
+    if "compression" not in config["cache"]:
+        config["cache"]["compression"] = True
+    if "backend" not in config["cache"]:
+        config["cache"]["backend"] = "memory"
+    if config["cache"]["backend"] not in ("memory", "redis"):
+        raise ValueError("cache backend must be memory or redis")
+    if config["cache"]["backend"] == "redis" and "redis_url" not in config["cache"]:
+        config["cache"]["redis_url"] = "redis://localhost:6379/0"
+    if "stale_ttl_seconds" not in config["cache"]:
+        config["cache"]["stale_ttl_seconds"] = 24 * config["cache"]["ttl_seconds"]
+    if "dtype" not in config["cache"]:
+        config["cache"]["dtype"] = "f64"
+    if config["cache"]["dtype"] not in EXPRESSION_DTYPES:
+        raise ValueError(f"cache dtype must be one of {', '.join(EXPRESSION_DTYPES)}")
         
     # Check server section
     if "name" not in config["server"]:
@@ -131,17 +609,43 @@ def validate_config(config: Dict) -> bool:
         
     return True
     
-def setup_cache(config: Dict) -> SimpleCache:
+def load_config(config_path: str, fallback_path: str = "config.example.json") -> Dict:
+    """
+    Read and validate the server configuration in a single pass,
+    falling back to the example config if config_path does not exist.
+    """
+    if not os.path.exists(config_path):
+        logger.warning(f"Config file not found at {config_path}, using example config")
+        config_path = fallback_path
+        
+    with open(config_path, 'rb') as f:
+        config = json_loads(f.read())
+        
+    validate_config(config)
+    return config
+    
+def setup_cache(config: Dict) -> Union[SimpleCache, RedisCache]:
     """Set up and return a cache instance based on configuration"""
     if not config["cache"]["enabled"]:
         # Return dummy cache that doesn't actually cache
         class DummyCache:
             def get(self, key): return None
-            def set(self, key, value): return True
+            def get_stale(self, key): return None
+            def refresh(self, key): pass
+            def set(self, key, value, validators=None): return True
             
         return DummyCache()
         
+    if config["cache"]["backend"] == "redis":
+        return RedisCache(
+            config["cache"]["redis_url"],
+            ttl_seconds=config["cache"]["ttl_seconds"],
+            compress=config["cache"]["compression"],
+            stale_ttl_seconds=config["cache"]["stale_ttl_seconds"]
+        )
+        
     return SimpleCache(
         ttl_seconds=config["cache"]["ttl_seconds"],
-        max_size_mb=config["cache"]["max_size_mb"]
+        max_size_mb=config["cache"]["max_size_mb"],
+        compress=config["cache"]["compression"]
     ) 
\ No newline at end of file